@@ -0,0 +1,51 @@
+
+(import 'itertools' islice)
+
+
+(def count_from (n)
+    """Yields n, n + 1, n + 2, ...forever."""
+    (while True
+        (yield n)
+        (+= n 1)
+    )
+)
+
+
+(def evens (xs)
+    (for x xs
+        (if ((not (% x 2)) (yield x)))
+    )
+)
+
+
+(def squares (xs)
+    (for x xs (yield (* x x)))
+)
+
+
+(def pipeline (xs)
+    (yield "start")
+    (yield from (squares (evens xs)))
+    (yield "end")
+)
+
+
+# Lazily chain lythp generators with each other and with itertools
+(= values (list (islice (pipeline (count_from 1)) 4)))
+(print values)
+(assert (== values ["start" 4 16 36]) values)
+
+
+(def running_total ()
+    """Adds up the values sent to it, yielding the total so far."""
+    (= total 0)
+    (while True
+        (+= total (yield total))
+    )
+)
+
+
+(= gen (running_total))
+(next gen)
+((.send gen) 5)
+(assert (== ((.send gen) 10) 15))
@@ -0,0 +1,26 @@
+
+(struct Point
+    """A point in 3D space."""
+    x
+    y
+    [z 0]
+    (order True)
+    (hash True)
+)
+
+
+(print (.__doc__ Point))
+
+
+(= p (Point 1 2))
+(print p)
+(assert (== p (Point 1 2 0)))
+(assert (< p (Point 1 3)))
+(assert (== (.z p) 0))
+
+(= .z p 5)
+(assert (== (repr p) "Point(x=1, y=2, z=5)") (repr p))
+
+# Hashable, so points can be used as dict keys
+(= names {((Point 0 0) "origin")})
+(assert (== ([(Point 0 0)] names) "origin"))
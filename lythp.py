@@ -1,13 +1,16 @@
 #!/usr/bin/env python
+import time
+START_TIME = time.perf_counter()
+
+# NOTE: to keep startup fast, modules which are only needed some of the time
+# (traceback, pprint, importlib.util) are imported where they're used.
+# So is ast, although the parser needs it as soon as it meets a literal, so
+# that only helps code which evaluates s-expressions without parsing text.
 import os
 import tokenize
-import traceback
 import sys
-import ast
 import builtins
 import operator
-import inspect
-from pprint import pprint
 from functools import wraps, reduce
 
 
@@ -17,6 +20,32 @@ def parse_bool(value):
 
 DEBUG_PARSE = parse_bool(os.environ.get('DEBUG_PARSE'))
 DEBUG_EXEC = parse_bool(os.environ.get('DEBUG_EXEC')) # TODO: do something with this...
+DEBUG_IMPORTS = parse_bool(os.environ.get('DEBUG_IMPORTS'))
+
+
+def parse_number(name, value, type):
+    """Parses the value of an environment variable for main(), exiting with
+    an error message if it's invalid"""
+    if not value:
+        return None
+    try:
+        return type(value)
+    except ValueError:
+        sys.exit(f"{name}: expected {type.__name__}, got: {value!r}")
+
+
+# Execution limits for the command line, see Limits.
+# They're parsed by main(), so that bad values can't break "import lythp".
+MAX_STEPS = os.environ.get('MAX_STEPS')
+MAX_TIME = os.environ.get('MAX_TIME')
+MAX_CPU_TIME = os.environ.get('MAX_CPU_TIME')
+MAX_MEMORY = os.environ.get('MAX_MEMORY')
+
+
+# Execution tracing for the command line: 'json' or 'heatmap' reports how
+# often each s-expression was evaluated, see CountingCollector
+TRACE = os.environ.get('TRACE')
+TRACE_SAMPLE_INTERVAL = os.environ.get('TRACE_SAMPLE_INTERVAL')
 
 
 REPL_PROMPT = '> '
@@ -133,12 +162,35 @@ IN_PLACE_OPERATORS = {
 
 
 def mklambda(name, var_names, *, var_defaults, env, exprs):
-    def f(*args, **kwargs):
-        vars = var_defaults.copy()
-        for name, value in zip(var_names, args):
-            vars[name] = value
-        vars.update(**kwargs)
-        return eval_exprs(exprs, env, vars=vars)
+    """Creates a Python function which evaluates the given s-expressions.
+    If any of them contain 'yield', the function is a generator function.
+
+        >>> vars = get_global_vars()
+        >>> exprs = text_to_exprs('(def f (n) (for i (range n) (yield (* i 10))))')
+        >>> f = eval_exprs(exprs, [], vars=vars)
+        >>> f(3)
+        <generator object f at ...>
+        >>> list(f(3))
+        [0, 10, 20]
+
+    """
+    yield_ids = find_yields(exprs)
+    if yield_ids:
+        def f(*args, **kwargs):
+            vars = var_defaults.copy()
+            for name, value in zip(var_names, args):
+                vars[name] = value
+            vars.update(**kwargs)
+            # A suspended generator keeps its local variables pushed onto
+            # the environment, so each call gets its own copy of it
+            return (yield from iter_exprs(exprs, env.copy(), yield_ids, vars=vars))
+    else:
+        def f(*args, **kwargs):
+            vars = var_defaults.copy()
+            for name, value in zip(var_names, args):
+                vars[name] = value
+            vars.update(**kwargs)
+            return eval_exprs(exprs, env, vars=vars)
 
     f.__name__ = f.__qualname__ = name
     if exprs and exprs[0][0] == 'literal' and isinstance(exprs[0][1], str):
@@ -147,20 +199,211 @@ def mklambda(name, var_names, *, var_defaults, env, exprs):
     return f
 
 
-def text_to_exprs(text):
-    lines = text.splitlines()
+def mkstruct(name, field_names, *, field_defaults, order=False, hash=False, doc=None):
+    """Creates a class with __slots__ for the given fields, and with
+    __init__, __repr__ and __eq__ methods (plus ordering and __hash__ if
+    requested) compiled from generated Python code, so that creating and
+    comparing instances doesn't go through the interpreter.
+
+        >>> Point = mkstruct('Point', ['x', 'y', 'z'], field_defaults={'z': 0}, order=True)
+        >>> Point(1, 2)
+        Point(x=1, y=2, z=0)
+        >>> Point(1, 2) == Point(1, 2, 0), Point(1, 2) < Point(1, 3)
+        (True, True)
+        >>> Point(1, 2).w = 3
+        Traceback (most recent call last):
+         ...
+        AttributeError: 'Point' object has no attribute 'w'
+
+    Names starting with '__' aren't allowed: type() would mangle private
+    names like '__x', and dunder names like '__dict__' or '__init__' would
+    clash with the class's own attributes:
+
+        >>> mkstruct('Point', ['__x'], field_defaults={})
+        Traceback (most recent call last):
+         ...
+        AssertionError: struct Point: invalid field name: '__x'...
+        >>> mkstruct('Point', ['__dict__'], field_defaults={})
+        Traceback (most recent call last):
+         ...
+        AssertionError: struct Point: invalid field name: '__dict__'...
+
+    """
+    import keyword
+
+    for field_name in field_names:
+        assert field_name.isidentifier() and not keyword.iskeyword(field_name) \
+            and field_name != 'self' and not field_name.startswith('__'), \
+            f"struct {name}: invalid field name: {field_name!r}"
+    assert len(set(field_names)) == len(field_names), f"struct {name}: duplicate field names"
+    seen_default = False
+    for field_name in field_names:
+        if field_name in field_defaults:
+            seen_default = True
+        else:
+            assert not seen_default, f"struct {name}: field without default follows field with default: {field_name!r}"
+
+    def fields_tuple(obj):
+        return '(' + ''.join(f'{obj}.{field_name}, ' for field_name in field_names) + ')'
+
+    params = ''.join(
+        f', {field_name}=_default_{field_name}' if field_name in field_defaults else f', {field_name}'
+        for field_name in field_names)
+    lines = [f'def __init__(self{params}):']
+    lines.extend(f'    self.{field_name} = {field_name}' for field_name in field_names)
+    lines.append('    pass')
+    fields_repr = ', '.join(f'{field_name}={{self.{field_name}!r}}' for field_name in field_names)
+    lines.append('def __repr__(self):')
+    lines.append(f'    return f"{{type(self).__qualname__}}({fields_repr})"')
+    ops = [('__eq__', '==')]
+    if order:
+        ops += [('__lt__', '<'), ('__le__', '<='), ('__gt__', '>'), ('__ge__', '>=')]
+    for method_name, op in ops:
+        lines.append(f'def {method_name}(self, other):')
+        lines.append(f'    if type(other) is not type(self):')
+        lines.append(f'        return NotImplemented')
+        lines.append(f'    return {fields_tuple("self")} {op} {fields_tuple("other")}')
+    if hash:
+        lines.append('def __hash__(self):')
+        lines.append(f'    return hash({fields_tuple("self")})')
+
+    namespace = {f'_default_{field_name}': value for field_name, value in field_defaults.items()}
+    exec('\n'.join(lines), namespace)
+
+    vars = {'__slots__': tuple(field_names), '__doc__': doc}
+    for method_name in ('__init__', '__repr__', '__eq__', '__lt__', '__le__', '__gt__', '__ge__', '__hash__'):
+        if method_name in namespace:
+            method = namespace[method_name]
+            method.__qualname__ = f'{name}.{method_name}'
+            vars[method_name] = method
+    if not hash:
+        vars['__hash__'] = None
+    return type(name, (), vars)
+
+
+def parse_struct(cmd, data, env):
+    """Parses the arguments of a 'struct' s-expression, creates the struct
+    with mkstruct, and stores it in a variable.
+    (Kept out of eval_expr, since every local variable there slows down
+    every evaluation.)
+
+        >>> env = [{}]
+        >>> parse_struct('struct', [('name', 'P'), ('name', 'x'), ('brack', [('name', 'y'), ('literal', 0)])], env)
+        <class 'lythp.P'>
+        >>> env[0]['P'](1)
+        P(x=1, y=0)
+
+    """
+    assert len(data) >= 1, f"{cmd}: need at least 1 argument"
+    assert data[0][0] == 'name', f"{cmd}: first argument must be a name, got s-expression of type: {data[0][0]!r}"
+    name = data[0][1]
+    subexprs = data[1:]
+
+    doc = None
+    if subexprs and subexprs[0][0] == 'literal' and isinstance(subexprs[0][1], str):
+        doc = subexprs[0][1]
+        subexprs = subexprs[1:]
+
+    field_names = []
+    field_defaults = {}
+    options = {}
+    for subtag, subdata in subexprs:
+        if subtag == 'name':
+            # Field
+            field_names.append(subdata)
+        elif subtag == 'brack':
+            # Field with default
+            assert len(subdata) == 2 and subdata[0][0] == 'name', f"{cmd}: expected [name default], got s-expression of length: {len(subdata)}"
+            field_name = subdata[0][1]
+            field_names.append(field_name)
+            field_defaults[field_name] = eval_expr(subdata[1], env)
+        elif subtag == 'paren':
+            # Option, e.g. (order True)
+            assert len(subdata) == 2 and subdata[0][0] == 'name', f"{cmd}: expected (option value), got s-expression of length: {len(subdata)}"
+            option = subdata[0][1]
+            assert option in ('order', 'hash'), f"{cmd}: unknown option: {option!r}"
+            options[option] = eval_expr(subdata[1], env)
+        else:
+            raise AssertionError(f"{cmd}: expected field or option, got s-expression of type: {subtag!r}")
+
+    cls = mkstruct(name, field_names, field_defaults=field_defaults, doc=doc, **options)
+    set_var(name, cls, env)
+    return cls
+
+
+def lazy_import(module_name):
+    """Returns a module which is only actually loaded the first time one of
+    its attributes is accessed.
+
+        >>> _ = sys.modules.pop('colorsys', None)
+        >>> colorsys = lazy_import('colorsys')
+        >>> type(colorsys).__name__
+        '_LazyModule'
+        >>> colorsys.hsv_to_rgb(0, 0, 1)
+        (1, 1, 1)
+        >>> type(colorsys).__name__
+        'module'
+        >>> _ = sys.modules.pop('colorsys')
+
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+
+    assert '.' not in module_name, f"Can't lazily import a submodule: {module_name!r}"
+    import importlib.util
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {module_name!r}", name=module_name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    loader.exec_module(module)
+    return module
+
+
+def import_module(module_name, *, lazy=False):
+    """Imports a module, for the 'import' and 'lazyimport' s-expressions.
+    If DEBUG_IMPORTS is set, the time taken is reported on stderr, similarly
+    to "python -X importtime"."""
+    if not DEBUG_IMPORTS:
+        return lazy_import(module_name) if lazy else __import__(module_name)
+
+    t0 = time.perf_counter()
+    module = lazy_import(module_name) if lazy else __import__(module_name)
+    import_time = int((time.perf_counter() - t0) * 1e6)
+    print(f"import time: {import_time:>10} us | {module_name}{' (lazy)' if lazy else ''}", file=sys.stderr)
+    return module
+
+
+def text_to_exprs(text, *, positions=None):
+    lines = text.splitlines(keepends=True)
     def readline():
-        return lines.pop().encode() if lines else b''
-    return tokens_to_exprs(tokenize.tokenize(readline))
+        return lines.pop(0).encode() if lines else b''
+    return tokens_to_exprs(tokenize.tokenize(readline), positions=positions)
 
 
-def tokens_to_exprs(tokens, *, repl=False):
-    """Converts an iterable of tokens into a list of s-expressions"""
+def tokens_to_exprs(tokens, *, repl=False, positions=None):
+    """Converts an iterable of tokens into a list of s-expressions.
+    If a positions dict is given, the (line, column) where each s-expression
+    starts is stored in it, keyed by the s-expression's id.
+
+        >>> positions = {}
+        >>> exprs = list(text_to_exprs('(print 1)\\n  (print 2)', positions=positions))
+        >>> [positions[id(expr)] for expr in exprs]
+        [(1, 0), (2, 2)]
+
+    """
+
+    from ast import literal_eval
 
     stack = []
     exprs = None
 
-    def produce(expr):
+    def produce(expr, start):
+        if positions is not None:
+            positions[id(expr)] = start
         if exprs is None:
             yield expr
         else:
@@ -175,34 +418,35 @@ def tokens_to_exprs(tokens, *, repl=False):
                 print(f"Parsing: {token}")
 
             if token.type in LITERAL_TOKEN_TYPES:
-                value = ast.literal_eval(token.string)
+                value = literal_eval(token.string)
                 expr = ('literal', value)
-                yield from produce(expr)
+                yield from produce(expr, token.start)
             elif token.exact_type == tokenize.LPAR:
-                stack.append((tokenize.RPAR, exprs))
+                stack.append((tokenize.RPAR, exprs, token.start))
                 exprs = []
             elif token.exact_type == tokenize.LSQB:
-                stack.append((tokenize.RSQB, exprs))
+                stack.append((tokenize.RSQB, exprs, token.start))
                 exprs = []
             elif token.exact_type == tokenize.LBRACE:
-                stack.append((tokenize.RBRACE, exprs))
+                stack.append((tokenize.RBRACE, exprs, token.start))
                 exprs = []
             elif token.exact_type in CLOSE_TOKEN_TYPES:
                 assert exprs is not None, f"Unexpected {token.string!r}"
                 tag = CLOSE_TOKEN_TAGS[token.exact_type]
                 expr = (tag, exprs)
-                expected_type, exprs = stack.pop()
+                expected_type, exprs, start = stack.pop()
                 assert expected_type == token.exact_type, f"Expected {CLOSE_TOKEN_TYPES[expected_type]}, got: {token.string!r}"
-                yield from produce(expr)
+                yield from produce(expr, start)
             elif token.type in NAME_TOKEN_TYPES:
                 # Make sure this check comes after checks of token.exact_type,
                 # since NAME_TOKEN_TYPES contains token.type, which is "inexact"
                 expr = ('name', token.string)
-                yield from produce(expr)
+                yield from produce(expr, token.start)
             else:
                 raise Exception(f"Unsupported token: {token!r}")
         except Exception:
             if repl:
+                import traceback
                 traceback.print_exc(file=sys.stderr)
                 print(REPL_PROMPT, end='', file=sys.stderr, flush=True)
             else:
@@ -288,6 +532,354 @@ def parse_var_names_and_defaults(expr, env):
     return var_names, var_defaults
 
 
+class LimitExceeded(Exception):
+    """Raised when a run of eval_exprs goes over one of its Limits.
+    The name of the limit (e.g. 'max_steps') is stored in the 'limit'
+    attribute."""
+
+    def __init__(self, limit, value, max_value):
+        super().__init__(f"{limit} exceeded: {value} > {max_value}")
+        self.limit = limit
+        self.value = value
+        self.max_value = max_value
+
+
+def get_memory_usage():
+    """Returns the resident memory of this process in bytes.
+    Where the current value isn't available, returns the peak value."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def set_memory_rlimit(max_memory):
+    """Limits the address space of this process to max_memory bytes, where
+    the OS supports it, so that allocations past it fail with MemoryError.
+    This is stricter than Limits' max_memory, since the address space
+    includes memory which is mapped but not resident."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    except (ImportError, AttributeError):
+        return
+    if hard != resource.RLIM_INFINITY:
+        max_memory = min(max_memory, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+class Limits:
+    """An execution budget for a run of eval_exprs.
+
+    Limits the number of evaluated s-expressions (max_steps), the wall-clock
+    and CPU time in seconds (max_time, max_cpu_time), and the resident memory
+    of the process in bytes (max_memory).
+    Going over a limit raises LimitExceeded.
+
+    Steps are counted on every call to eval_expr (via STEP_HOOK), but the
+    other limits are only checked every check_interval steps, to keep the
+    overhead down.
+    Time spent inside a single call to a Python function can't be
+    interrupted.
+    Likewise, max_memory is not a hard ceiling: a single step can allocate
+    far more than it before the next check. For a hard ceiling, see
+    set_memory_rlimit, which the command line uses when MAX_MEMORY is set.
+
+    The current limits are stored in the global LIMITS (a thread-local
+    would slow down every evaluation step), so only one thread per process
+    should run eval_exprs with limits at a time.
+
+        >>> vars = get_global_vars()
+        >>> exprs = list(text_to_exprs('(while True)'))
+        >>> eval_exprs(exprs, [], vars=vars, limits=Limits(max_steps=100))
+        Traceback (most recent call last):
+         ...
+        lythp.LimitExceeded: max_steps exceeded: 101 > 100
+
+        >>> eval_exprs(exprs, [], vars=vars, limits=Limits(max_time=0.01))
+        Traceback (most recent call last):
+         ...
+        lythp.LimitExceeded: max_time exceeded: ...
+
+    In the REPL, going over a limit also ends the run:
+
+        >>> exprs = list(text_to_exprs('(while True) (print "Not reached")'))
+        >>> eval_exprs(exprs, [], vars=vars, repl=True, limits=Limits(max_steps=100))
+        Traceback (most recent call last):
+         ...
+        lythp.LimitExceeded: max_steps exceeded: 101 > 100
+
+    """
+
+    def __init__(self, *, max_steps=None, max_time=None, max_cpu_time=None,
+            max_memory=None, check_interval=1000):
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.max_cpu_time = max_cpu_time
+        self.max_memory = max_memory
+        self.check_interval = check_interval
+        self.start()
+
+    def start(self):
+        """Resets the step count and the clocks"""
+        self.steps = 0
+        self.start_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.next_check = 0
+        self.check()
+
+    def step(self, expr, env):
+        """Called on every evaluation step, see STEP_HOOK"""
+        self.steps += 1
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        """Raises LimitExceeded if any limit has been exceeded"""
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise LimitExceeded('max_steps', self.steps, self.max_steps)
+        if self.max_time is not None:
+            value = time.perf_counter() - self.start_time
+            if value > self.max_time:
+                raise LimitExceeded('max_time', value, self.max_time)
+        if self.max_cpu_time is not None:
+            value = time.process_time() - self.start_cpu_time
+            if value > self.max_cpu_time:
+                raise LimitExceeded('max_cpu_time', value, self.max_cpu_time)
+        if self.max_memory is not None:
+            value = get_memory_usage()
+            if value > self.max_memory:
+                raise LimitExceeded('max_memory', value, self.max_memory)
+
+        self.next_check = self.steps + self.check_interval
+        if self.max_steps is not None:
+            self.next_check = min(self.next_check, self.max_steps + 1)
+
+
+# The Limits of the current run of eval_exprs, if any.
+# NOTE: shared by all threads, see Limits
+LIMITS = None
+
+
+# Called as TRACE_HOOK(expr, env) on every evaluation step, see set_trace_hook.
+# NOTE: shared by all threads
+TRACE_HOOK = None
+
+
+# Called as STEP_HOOK(expr, env) on every evaluation step, if set.
+# Combines LIMITS and TRACE_HOOK, so that the evaluator only has to check
+# a single global; see update_step_hook
+STEP_HOOK = None
+
+
+def update_step_hook():
+    """Sets STEP_HOOK from LIMITS and TRACE_HOOK; call this whenever either
+    of them changes"""
+    global STEP_HOOK
+    if LIMITS is None:
+        STEP_HOOK = TRACE_HOOK
+    elif TRACE_HOOK is None:
+        STEP_HOOK = LIMITS.step
+    else:
+        limits_step = LIMITS.step
+        trace_hook = TRACE_HOOK
+        def step_hook(expr, env):
+            limits_step(expr, env)
+            trace_hook(expr, env)
+        STEP_HOOK = step_hook
+
+
+SPECIAL_FORMS = {
+    'import', 'lazyimport', 'def', 'class', 'struct', 'lambda', ',', '.',
+    '=', 'do', 'raise', 'for', 'while', 'if', 'and', 'or', 'yield', 'assert',
+    *IN_PLACE_OPERATORS,
+}
+
+
+def set_trace_hook(hook):
+    """Sets a function to be called as hook(expr, env) every time an
+    s-expression is evaluated, or None to remove it.
+    Returns the previous hook.
+    Like LIMITS, the hook is global, so it sees evaluations from all threads.
+
+        >>> exprs = list(text_to_exprs('(+ 1 2)'))
+        >>> old_hook = set_trace_hook(lambda expr, env: print(expr))
+        >>> eval_exprs(exprs, [get_global_vars()])
+        ('paren', [('name', '+'), ('literal', 1), ('literal', 2)])
+        ('name', '+')
+        ('literal', 1)
+        ('literal', 2)
+        3
+        >>> set_trace_hook(old_hook)
+        <function <lambda> at ...>
+
+    """
+    global TRACE_HOOK
+    old_hook = TRACE_HOOK
+    TRACE_HOOK = hook
+    update_step_hook()
+    return old_hook
+
+
+def get_form_name(expr):
+    """Returns a name for the kind of the given s-expression, for reporting.
+
+        >>> get_form_name(('paren', [('name', 'for'), ('name', 'x'), ('name', 'xs')]))
+        'for'
+        >>> get_form_name(('paren', [('name', 'f'), ('name', 'x')]))
+        'call'
+        >>> get_form_name(('paren', [('brack', [('literal', 0)]), ('name', 'xs')]))
+        'lookup'
+        >>> get_form_name(('name', 'x'))
+        'name'
+
+    """
+    tag, data = expr
+    if tag == 'paren' and data:
+        expr0 = data[0]
+        if expr0[0] == 'brack' or expr0 == ('name', '.'):
+            return 'lookup'
+        elif expr0[0] == 'name' and expr0[1] in SPECIAL_FORMS:
+            return expr0[1]
+        return 'call'
+    return tag
+
+
+class CountingCollector:
+    """A trace hook which counts how often each s-expression is evaluated.
+    If the positions dict from tokens_to_exprs is given, counts can be
+    reported by source position.
+
+        >>> positions = {}
+        >>> exprs = list(text_to_exprs('(for x (range 3)\\n    (print x))', positions=positions))
+        >>> collector = CountingCollector(positions=positions)
+        >>> old_hook = set_trace_hook(collector)
+        >>> eval_exprs(exprs, [get_global_vars()])
+        0
+        1
+        2
+        >>> old_hook = set_trace_hook(old_hook)
+        >>> collector.get_form_counts()
+        {'name': 7, 'call': 4, 'for': 1, 'literal': 1}
+        >>> print(collector.format_heatmap(['(for x (range 3)', '    (print x))']))
+              2 ##############       | (for x (range 3)
+              3 #################### |     (print x))
+
+    """
+
+    def __init__(self, *, positions=None):
+        self.positions = positions
+        # Both keyed by id(expr); we keep a reference to each expr, so that
+        # its id can't be reused by another one
+        self.counts = {}
+        self.exprs = {}
+
+    # Only one in about this many evaluations is counted (see
+    # SamplingCollector), so the reported counts are scaled up by it
+    interval = 1
+
+    def __call__(self, expr, env):
+        key = id(expr)
+        count = self.counts.get(key)
+        if count is None:
+            self.counts[key] = 1
+            self.exprs[key] = expr
+        else:
+            self.counts[key] = count + 1
+
+    def get_form_counts(self):
+        """Returns the number of evaluations of each kind of s-expression
+        (see get_form_name), most frequent first"""
+        form_counts = {}
+        for key, count in self.counts.items():
+            form_name = get_form_name(self.exprs[key])
+            form_counts[form_name] = form_counts.get(form_name, 0) + count * self.interval
+        return dict(sorted(form_counts.items(), key=lambda item: -item[1]))
+
+    def get_expr_counts(self):
+        """Returns a list of dicts with the number of evaluations of each
+        s-expression, most frequent first"""
+        positions = self.positions or {}
+        expr_counts = []
+        for key, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+            line, column = positions.get(key, (None, None))
+            expr_counts.append({
+                'form': get_form_name(self.exprs[key]),
+                'line': line,
+                'column': column,
+                'count': count * self.interval,
+            })
+        return expr_counts
+
+    def to_json(self, **kwargs):
+        """Dumps the counts as JSON"""
+        import json
+        return json.dumps({
+            'sample_interval': self.interval,
+            'forms': self.get_form_counts(),
+            'exprs': self.get_expr_counts(),
+        }, **kwargs)
+
+    def format_heatmap(self, lines, *, width=20):
+        """Returns the given source lines, each prefixed with the number of
+        evaluations of the parenthesized s-expressions starting on it, and
+        a bar of up to the given width"""
+        assert self.positions is not None, "Can't make a heatmap without positions"
+        line_counts = {}
+        for key, count in self.counts.items():
+            if key in self.positions and self.exprs[key][0] == 'paren':
+                line = self.positions[key][0]
+                line_counts[line] = line_counts.get(line, 0) + count * self.interval
+        max_count = max(line_counts.values(), default=0)
+
+        heatmap_lines = []
+        for line_number, line in enumerate(lines, 1):
+            count = line_counts.get(line_number, 0)
+            bar = '#' * -(-count * width // max_count) if count else ''
+            count_str = str(count) if count else ''
+            heatmap_lines.append(f"{count_str:>7} {bar:<{width}} | {line.rstrip()}")
+        return '\n'.join(heatmap_lines)
+
+
+class SamplingCollector(CountingCollector):
+    """A CountingCollector which only counts about one in every interval
+    evaluations, at random, to keep the overhead down.
+    The reported counts are scaled up by the interval, so they are estimates
+    of the real ones.
+
+        >>> import json, random
+        >>> random.seed(0)
+        >>> exprs = list(text_to_exprs('(for x (range 10000) (abs x))'))
+        >>> collector = SamplingCollector(interval=10)
+        >>> old_hook = set_trace_hook(collector)
+        >>> eval_exprs(exprs, [get_global_vars()])
+        9999
+        >>> old_hook = set_trace_hook(old_hook)
+        >>> 9000 < collector.get_form_counts()['call'] < 11000
+        True
+        >>> json.loads(collector.to_json())['sample_interval']
+        10
+
+    """
+
+    def __init__(self, *, interval=100, positions=None):
+        import random
+        super().__init__(positions=positions)
+        self.interval = interval
+        self.randint = random.randint
+        self.countdown = self.randint(1, 2 * interval - 1)
+
+    def __call__(self, expr, env):
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.randint(1, 2 * self.interval - 1)
+        super().__call__(expr, env)
+
+
 def eval_expr(expr, env):
     """Evaluates a single s-expression, returning its value
 
@@ -361,6 +953,9 @@ def eval_expr(expr, env):
 
     """
 
+    if STEP_HOOK is not None:
+        STEP_HOOK(expr, env)
+
     def call(func, arg_exprs):
         arg_values = (eval_expr(expr, env) for expr in arg_exprs)
         return func(*arg_values)
@@ -395,11 +990,13 @@ def eval_expr(expr, env):
         expr0 = data[0]
         data = data[1:]
         cmd = expr0[1]
-        if expr0 == ('name', 'import'):
+        if expr0 == ('name', 'import') or expr0 == ('name', 'lazyimport'):
             # Import module / from module
             assert len(data) >= 1, f"{cmd}: need at least 1 argument"
+            lazy = cmd == 'lazyimport'
+            assert not lazy or len(data) == 1, f"{cmd}: can't import names without loading the module"
             module_name = eval_expr(data[0], env)
-            module = __import__(module_name)
+            module = import_module(module_name, lazy=lazy)
             if len(data) == 1:
                 set_var(module_name, module, env)
             else:
@@ -446,6 +1043,9 @@ def eval_expr(expr, env):
             cls = type(name, bases, vars)
             set_var(name, cls, env)
             return cls
+        elif expr0 == ('name', 'struct'):
+            # Defining a struct and storing it in a variable
+            return parse_struct(cmd, data, env)
         elif expr0 == ('name', 'lambda'):
             # Creating a Lambda
             assert len(data) >= 1, f"{cmd}: need at least 1 argument"
@@ -622,6 +1222,9 @@ def eval_expr(expr, env):
                 if value:
                     break
             return value
+        elif expr0 == ('name', 'yield'):
+            # Only valid in the body of a function, see iter_expr
+            raise AssertionError(f"{cmd}: outside function")
         elif expr0 == ('name', 'assert'):
             # Make an assertion
             assert len(data) >= 1, f"{cmd}: need at least 1 argument"
@@ -641,8 +1244,9 @@ def eval_expr(expr, env):
         raise ValueError(f"Unrecognized s-expression tag: {tag!r}")
 
 
-def eval_exprs(exprs, env, *, vars=None, repl=False):
+def eval_exprs(exprs, env, *, vars=None, repl=False, limits=None):
     """Evaluates a list of s-expressions, returning the value of the last one.
+    If limits are given, they apply until this call returns, see Limits.
 
         >>> vars = get_global_vars()
         >>> exprs = text_to_exprs('(def f ((x) (y "default")) (, x y)) (print (f 1 2)) (print (f 1))')
@@ -681,6 +1285,8 @@ def eval_exprs(exprs, env, *, vars=None, repl=False):
         3
 
     """
+    if limits is not None:
+        return eval_exprs_with_limits(exprs, env, vars=vars, repl=repl, limits=limits)
 
     # push a fresh dict of local variables onto the environment
     env.append({} if vars is None else vars)
@@ -689,8 +1295,13 @@ def eval_exprs(exprs, env, *, vars=None, repl=False):
     for expr in exprs:
         try:
             value = eval_expr(expr, env)
+        except LimitExceeded:
+            # The limits apply to the whole run, so there's no point
+            # carrying on in the REPL
+            raise
         except Exception:
             if repl:
+                import traceback
                 traceback.print_exc(file=sys.stderr)
             else:
                 raise
@@ -706,6 +1317,197 @@ def eval_exprs(exprs, env, *, vars=None, repl=False):
     return value
 
 
+def eval_exprs_with_limits(exprs, env, *, vars, repl, limits):
+    """Calls eval_exprs with the given Limits installed as LIMITS.
+    (Kept out of eval_exprs, since it made every call to it slower.)"""
+    global LIMITS
+    old_limits = LIMITS
+    LIMITS = limits
+    update_step_hook()
+    limits.start()
+    try:
+        return eval_exprs(exprs, env, vars=vars, repl=repl)
+    finally:
+        LIMITS = old_limits
+        update_step_hook()
+
+
+def find_yields(exprs):
+    """Finds the s-expressions which contain a 'yield', not counting those
+    inside nested function and class definitions.
+    Returns a set of their ids, for use by iter_expr.
+
+        >>> find_yields(list(text_to_exprs('(print 1) (lambda () (yield 2))')))
+        set()
+        >>> exprs = list(text_to_exprs('(print 1) (print (yield 2))'))
+        >>> sorted(find_yields(exprs)) == sorted([id(exprs[1]), id(exprs[1][1][1])])
+        True
+
+    """
+    yield_ids = set()
+
+    def visit(expr):
+        tag, data = expr
+        if tag not in ('paren', 'brack', 'brace'):
+            return False
+        if tag == 'paren' and data:
+            if data[0] in (('name', 'def'), ('name', 'lambda'), ('name', 'class')):
+                return False
+            found = data[0] == ('name', 'yield')
+        else:
+            found = False
+        for subexpr in data:
+            if visit(subexpr):
+                found = True
+        if found:
+            yield_ids.add(id(expr))
+        return found
+
+    for expr in exprs:
+        visit(expr)
+    return yield_ids
+
+
+def iter_expr(expr, env, yield_ids):
+    """Generator version of eval_expr, used for the bodies of functions
+    containing 'yield'.
+    Yields whatever the s-expression yields, and returns its value.
+    S-expressions without a 'yield' in them are passed on to eval_expr.
+
+        >>> exprs = list(text_to_exprs('(yield 1) (yield from [2 3])'))
+        >>> yield_ids = find_yields(exprs)
+        >>> list(iter_exprs(exprs, [], yield_ids))
+        [1, 2, 3]
+
+        >>> vars = get_global_vars()
+        >>> exprs = list(text_to_exprs('(while True (= x (yield)) (print "got:" x))'))
+        >>> gen = iter_exprs(exprs, [vars], find_yields(exprs))
+        >>> next(gen)
+        >>> gen.send(1)
+        got: 1
+        >>> gen.send(2)
+        got: 2
+
+    """
+    if id(expr) not in yield_ids:
+        return eval_expr(expr, env)
+
+    if STEP_HOOK is not None:
+        STEP_HOOK(expr, env)
+
+    tag, data = expr
+    if tag == 'brack':
+        # List constructor
+        values = []
+        for subexpr in data:
+            values.append((yield from iter_expr(subexpr, env, yield_ids)))
+        return values
+    assert tag == 'paren', f"'yield' is not supported inside s-expression of type: {tag!r}"
+
+    expr0 = data[0]
+    data = data[1:]
+    cmd = expr0[1]
+    if expr0 == ('name', 'yield'):
+        if data and data[0] == ('name', 'from'):
+            assert len(data) == 2, f"{cmd} from: need exactly 1 argument"
+            value = yield from iter_expr(data[1], env, yield_ids)
+            return (yield from value)
+        assert len(data) <= 1, f"{cmd}: need at most 1 argument, got: {len(data)}"
+        value = (yield from iter_expr(data[0], env, yield_ids)) if data else None
+        return (yield value)
+    elif expr0 == ('name', '=') or expr0[0] == 'name' and cmd in IN_PLACE_OPERATORS:
+        # Assignment
+        func = IN_PLACE_OPERATORS.get(cmd)
+        assert len(data) >= 1, f"{cmd}: need at least 1 argument"
+        assert data[0][0] == 'name' and data[0][1] != '.', \
+            f"{cmd}: 'yield' is only supported when assigning to a variable"
+        name = data[0][1]
+        value = yield from iter_exprs(data[1:], env, yield_ids)
+        if func:
+            old_value = get_var(name, env)
+            value = func(old_value, value)
+        set_var(name, value, env)
+        return value
+    elif expr0 == ('name', ','):
+        # Tuple constructor
+        values = []
+        for subexpr in data:
+            values.append((yield from iter_expr(subexpr, env, yield_ids)))
+        return tuple(values)
+    elif expr0 == ('name', 'do'):
+        return (yield from iter_exprs(data, env, yield_ids))
+    elif expr0 == ('name', 'raise'):
+        value = yield from iter_exprs(data, env, yield_ids)
+        raise value
+    elif expr0 == ('name', 'for'):
+        # For loop
+        assert len(data) >= 2, f"{cmd}: need at least 2 arguments"
+        assert data[0][0] == 'name', f"{cmd}: first argument must be a name, got s-expression of type: {data[0][0]!r}"
+        name = data[0][1]
+        for_value = yield from iter_expr(data[1], env, yield_ids)
+        exprs = data[2:]
+
+        value = None
+        for item in for_value:
+            vars = {name: item}
+            value = yield from iter_exprs(exprs, env, yield_ids, vars=vars)
+        return value
+    elif expr0 == ('name', 'while'):
+        # While loop
+        assert len(data) >= 1, f"{cmd}: need at least 1 argument"
+        cond_expr = data[0]
+        exprs = data[1:]
+
+        value = None
+        while (yield from iter_expr(cond_expr, env, yield_ids)):
+            value = yield from iter_exprs(exprs, env, yield_ids)
+        return value
+    elif expr0 == ('name', 'if'):
+        # If expression
+        for subtag, subdata in data:
+            assert subtag == 'paren', f"{cmd}: each sub-expression must be of type 'paren', but got: {subtag!r}"
+            assert len(subdata) >= 1, f"{cmd}: each sub-expression needs at least 1 argument"
+            cond_value = yield from iter_expr(subdata[0], env, yield_ids)
+            if cond_value:
+                return (yield from iter_exprs(subdata[1:], env, yield_ids))
+        return None
+    elif expr0 == ('name', 'and') or expr0 == ('name', 'or'):
+        # And/or expression
+        assert len(data) >= 1, f"{cmd}: need at least 1 argument"
+        for subexpr in data:
+            value = yield from iter_expr(subexpr, env, yield_ids)
+            if bool(value) != (cmd == 'and'):
+                break
+        return value
+    elif expr0[0] == 'brack' or expr0 in (
+            ('name', 'import'), ('name', 'lazyimport'), ('name', '.'),
+            ('name', 'assert'), ('name', 'struct')):
+        raise AssertionError(f"{cmd}: 'yield' is not supported here")
+    else:
+        # Perform a function call
+        func = yield from iter_expr(expr0, env, yield_ids)
+        arg_values = []
+        for subexpr in data:
+            arg_values.append((yield from iter_expr(subexpr, env, yield_ids)))
+        return func(*arg_values)
+
+
+def iter_exprs(exprs, env, yield_ids, *, vars=None):
+    """Generator version of eval_exprs, see iter_expr."""
+
+    # push a fresh dict of local variables onto the environment
+    env.append({} if vars is None else vars)
+
+    value = None
+    for expr in exprs:
+        value = yield from iter_expr(expr, env, yield_ids)
+
+    # pop local variables
+    env.pop()
+
+    return value
+
+
 def get_global_vars():
     global_vars = BUILTINS.copy()
     global_vars.update(IN_PLACE_OPERATORS)
@@ -742,18 +1544,68 @@ def main():
             return sys.stdin.readline().encode()
         repl = True
 
+    if DEBUG_IMPORTS:
+        startup_time = int((time.perf_counter() - START_TIME) * 1e6)
+        print(f"startup time: {startup_time:>10} us", file=sys.stderr)
+
     if DEBUG_PARSE:
+        from pprint import pprint
         tokens = tokenize.tokenize(readline)
         exprs = tokens_to_exprs(tokens)
         for expr in exprs:
             pprint(expr)
     else:
+        max_steps = parse_number('MAX_STEPS', MAX_STEPS, int)
+        max_time = parse_number('MAX_TIME', MAX_TIME, float)
+        max_cpu_time = parse_number('MAX_CPU_TIME', MAX_CPU_TIME, float)
+        max_memory = parse_number('MAX_MEMORY', MAX_MEMORY, int)
+        limit_values = (max_steps, max_time, max_cpu_time, max_memory)
+        if any(value is not None for value in limit_values):
+            limits = Limits(max_steps=max_steps, max_time=max_time,
+                max_cpu_time=max_cpu_time, max_memory=max_memory)
+        else:
+            limits = None
+        if max_memory is not None:
+            set_memory_rlimit(max_memory)
+
+        sample_interval = parse_number('TRACE_SAMPLE_INTERVAL', TRACE_SAMPLE_INTERVAL, int)
+        positions = None
+        if TRACE:
+            assert TRACE in ('json', 'heatmap'), f"Unknown TRACE value: {TRACE!r}"
+
+            # Keep the source lines for the heatmap
+            source_lines = []
+            read_source_line = readline
+            def readline():
+                line = read_source_line()
+                source_lines.append(line.decode(errors='replace'))
+                return line
+
+            positions = {}
+            if sample_interval:
+                collector = SamplingCollector(interval=sample_interval, positions=positions)
+            else:
+                collector = CountingCollector(positions=positions)
+            set_trace_hook(collector)
+
         if repl:
             print(REPL_PROMPT, end='', file=sys.stderr, flush=True)
         tokens = tokenize.tokenize(readline)
-        exprs = tokens_to_exprs(tokens, repl=repl)
+        exprs = tokens_to_exprs(tokens, repl=repl, positions=positions)
         global_vars = get_global_vars()
-        eval_exprs(exprs, [], vars=global_vars, repl=repl)
+        try:
+            eval_exprs(exprs, [], vars=global_vars, repl=repl, limits=limits)
+        except LimitExceeded as ex:
+            sys.exit(f"{type(ex).__name__}: {ex}")
+        except MemoryError:
+            if max_memory is None:
+                raise
+            sys.exit(f"MemoryError: MAX_MEMORY exceeded: {max_memory} bytes")
+        finally:
+            if TRACE == 'json':
+                print(collector.to_json(indent=4), file=sys.stderr)
+            elif TRACE == 'heatmap':
+                print(collector.format_heatmap(source_lines), file=sys.stderr)
 
 
 if __name__ == '__main__':